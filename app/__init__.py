@@ -1,15 +1,28 @@
+import os
+import redis
 from flask import Flask
-from .extensions import db, login_manager
+from itsdangerous import URLSafeTimedSerializer
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import event
+from .extensions import db, login_manager, server_session, cache, set_sqlite_pragmas, init_logging, REDIS_URL
 from .models import User
-from .utils import avatar_url_for, order_total
+from .utils import avatar_url_for, order_total, get_cart, cart_size
 
 def create_app():
     """
     Создаёт и настраивает экземпляр Flask-приложения.
 
-    Выполняет инициализацию расширений (SQLAlchemy, Flask-Login), регистрирует
-    блюпринты публичной части магазина, аутентификации и админ-панели, а также
-    создаёт таблицы базы данных при первом запуске.
+    Выполняет инициализацию расширений (SQLAlchemy, Flask-Login) для базы из
+    'DATABASE_URL' (по умолчанию SQLite-файл 'shop.db'), включает для
+    SQLite режим WAL, при заданном 'REDIS_URL' переносит сессии (и корзину)
+    в Redis и включает там общий для всех воркеров кэш страниц Flask-Caching
+    (без Redis кэш страниц отключён: 'NullCache'),
+    создаёт общий сериализатор токенов 'itsdangerous' и каталоги для загрузок,
+    включает общий для всех воркеров файловый кэш байткода шаблонов Jinja2,
+    направляет логи приложения через очередь в фоновый поток,
+    регистрирует блюпринты публичной части магазина, аутентификации и
+    админ-панели. Таблицы базы данных создаются отдельно
+    командой 'flask --app run init-db'.
 
     Возвращает:
         Flask: Сконфигурированный экземпляр приложения.
@@ -17,13 +30,39 @@ def create_app():
     app = Flask(__name__, instance_relative_config=False, template_folder='../templates', static_folder='../static')
     app.config.update(
         SECRET_KEY="dev_secret_key_change_me",
-        SQLALCHEMY_DATABASE_URI="sqlite:///shop.db",
+        SQLALCHEMY_DATABASE_URI=os.environ.get("DATABASE_URL", "sqlite:///shop.db"),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
-        UPLOAD_FOLDER="static/uploads"
+        SQLALCHEMY_ENGINE_OPTIONS={
+            "pool_size": 20,
+            "max_overflow": 10,
+            "query_cache_size": 1200,
+        },
+        UPLOAD_FOLDER="static/uploads",
+        USE_X_SENDFILE=os.environ.get("USE_X_SENDFILE") == "1",
+        APP_BASE_URL=os.environ.get("APP_BASE_URL", "").rstrip("/"),
+        JINJA_CACHE_DIR=os.environ.get("JINJA_CACHE_DIR")
     )
+    if not app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"].update(pool_pre_ping=True, pool_recycle=1800)
+    if app.config["JINJA_CACHE_DIR"]:
+        os.makedirs(app.config["JINJA_CACHE_DIR"], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config["JINJA_CACHE_DIR"])
+    init_logging(app)
+    os.makedirs(os.path.join(app.config["UPLOAD_FOLDER"], "avatars"), exist_ok=True)
+    if REDIS_URL:
+        app.config.update(SESSION_TYPE="redis", SESSION_REDIS=redis.Redis.from_url(REDIS_URL))
+        server_session.init_app(app)
+        app.config.update(CACHE_TYPE="RedisCache", CACHE_REDIS_URL=REDIS_URL)
+    else:
+        app.config.update(CACHE_TYPE="NullCache")
+    cache.init_app(app)
 
     db.init_app(app)
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            event.listen(db.engine, "connect", set_sqlite_pragmas)
     login_manager.init_app(app)
+    app.extensions["ts"] = URLSafeTimedSerializer(app.config["SECRET_KEY"], salt="email-confirm-salt")
 
     @login_manager.user_loader
     def load_user(user_id: str):
@@ -46,13 +85,14 @@ def create_app():
         """
         Добавляет вспомогательные функции в контекст шаблонов Jinja2.
 
-        В шаблонах становятся доступны функции 'avatar_url_for' и 'order_total'
-        без необходимости явного импорта в каждом шаблоне.
+        В шаблонах становятся доступны функции 'avatar_url_for', 'order_total',
+        'get_cart' и 'cart_size' без необходимости явного импорта в каждом шаблоне.
 
         Возвращает:
             dict: Словарь с функциями, добавляемыми в контекст шаблонов.
         """
-        return {"avatar_url_for": avatar_url_for, "order_total": order_total}
+        return {"avatar_url_for": avatar_url_for, "order_total": order_total,
+                "get_cart": get_cart, "cart_size": cart_size}
 
     from .blueprints.shop.routes import shop_bp
     from .blueprints.auth.routes import auth_bp
@@ -60,7 +100,4 @@ def create_app():
     app.register_blueprint(shop_bp)
     app.register_blueprint(auth_bp, url_prefix="/")
     app.register_blueprint(admin_bp, url_prefix="/admin")
-
-    with app.app_context():
-        db.create_all()
     return app
@@ -1,13 +1,25 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, abort
 from flask_login import login_required
-from ...utils import admin_required, allowed_file
+from sqlalchemy import select, func
+from sqlalchemy.orm import selectinload, load_only
+from ...utils import admin_required, allowed_file, save_upload, bump_catalog_version
 from ...extensions import db
-from ...models import Category, Product, Order
+from ...models import Category, Product, Order, OrderItem
 from werkzeug.utils import secure_filename
-import os
+import os, time
 
 admin_bp = Blueprint("admin", __name__)
 
+_PER_PAGE = 25
+
+_STATUS_MAP = {
+    "new": "new",
+    "pending": "Обработка платежа",
+    "awaiting_payment": "Ожидание платежа",
+    "paid": "Оплачено",
+    "canceled": "Платёж отменён",
+}
+
 @admin_bp.before_request
 def _check_admin():
     """
@@ -21,21 +33,80 @@ def _check_admin():
     """
     admin_required()
 
+@admin_bp.after_request
+def _conditional(resp):
+    """
+    Добавляет к GET-ответам админ-панели 'ETag' и заголовки кэширования.
+
+    Браузеру разрешено хранить страницу только приватно и с обязательной
+    перепроверкой. Если пришедший 'If-None-Match' совпадает с 'ETag'
+    новой страницы, вместо тела возвращается ответ '304 Not Modified'.
+
+    Параметры:
+        resp: Ответ, сформированный обработчиком маршрута.
+
+    Возвращает:
+        Response: Тот же ответ с заголовками кэширования или ответ 304.
+    """
+    if request.method != "GET" or resp.status_code != 200 or resp.direct_passthrough:
+        return resp
+    resp.cache_control.private = True
+    resp.cache_control.max_age = 0
+    resp.cache_control.must_revalidate = True
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+def _dashboard_stats() -> tuple[int, int, int]:
+    """
+    Подсчитывает количество товаров, категорий и заказов для главной страницы.
+
+    Все три счётчика получаются одним SQL-запросом со скалярными подзапросами.
+    Результат хранится в 'app.extensions' текущего приложения вместе с номером
+    минуты, поэтому повторные заходы на панель в пределах минуты не обращаются
+    к БД, а разные экземпляры приложения не видят счётчики друг друга.
+
+    Возвращает:
+        tuple[int, int, int]: Количество товаров, категорий и заказов.
+    """
+    minute = int(time.time() // 60)
+    cached = current_app.extensions.get("dashboard_stats")
+    if cached and cached[0] == minute:
+        return cached[1]
+    row = db.session.execute(select(
+        select(func.count()).select_from(Product).scalar_subquery().label("products"),
+        select(func.count()).select_from(Category).scalar_subquery().label("categories"),
+        select(func.count()).select_from(Order).scalar_subquery().label("orders"),
+    )).one()
+    stats = (row.products, row.categories, row.orders)
+    current_app.extensions["dashboard_stats"] = (minute, stats)
+    return stats
+
+def _clear_dashboard_stats() -> None:
+    """
+    Сбрасывает сохранённые счётчики панели после создания или удаления записей.
+
+    Возвращает:
+        None: Счётчики будут пересчитаны при следующем заходе на панель.
+    """
+    current_app.extensions.pop("dashboard_stats", None)
+
 @admin_bp.route("/")
 @login_required
 def index():
     """
     Отображает главную страницу админ-панели с краткой статистикой.
 
-    Показывает количество товаров, категорий и заказов в базе данных.
+    Показывает количество товаров, категорий и заказов в базе данных
+    (значения обновляются не реже раза в минуту, см. '_dashboard_stats').
 
     Возвращает:
         Response: HTML-страница панели администратора.
     """
+    products, categories, orders = _dashboard_stats()
     stats = {
-        "products": Product.query.count(),
-        "categories": Category.query.count(),
-        "orders": Order.query.count()
+        "products": products,
+        "categories": categories,
+        "orders": orders
     }
     return render_template("admin/index.html", stats=stats)
 
@@ -45,13 +116,15 @@ def categories():
     """
     Отображает список всех категорий товаров в админ-панели.
 
-    Категории сортируются по названию в алфавитном порядке.
+    Категории сортируются по названию в алфавитном порядке и выводятся
+    постранично; номер страницы передаётся параметром 'page'.
 
     Возвращает:
         Response: HTML-страница со списком категорий.
     """
-    cats = Category.query.order_by(Category.name.asc()).all()
-    return render_template("admin/categories.html", categories=cats)
+    page = request.args.get("page", 1, type=int)
+    pagination = Category.query.order_by(Category.name.asc()).paginate(page=page, per_page=_PER_PAGE, error_out=False)
+    return render_template("admin/categories.html", categories=pagination.items, pagination=pagination)
 
 @admin_bp.route("/categories/new", methods=["GET","POST"])
 @login_required
@@ -70,11 +143,13 @@ def category_new():
         if not name:
             flash("Название обязательно!")
             return render_template("admin/category_form.html", category=None)
-        if Category.query.filter_by(name=name).first():
+        if db.session.query(Category.query.filter_by(name=name).exists()).scalar():
             flash("Такая категория уже существует!")
             return render_template("admin/category_form.html", category=None, name=name)
         db.session.add(Category(name=name))
         db.session.commit()
+        _clear_dashboard_stats()
+        bump_catalog_version()
         return redirect(url_for("admin.categories"))
     return render_template("admin/category_form.html", category=None)
 
@@ -101,6 +176,7 @@ def category_edit(cid: int):
             return render_template("admin/category_form.html", category=cat)
         cat.name = name
         db.session.commit()
+        bump_catalog_version()
         return redirect(url_for("admin.categories"))
     return render_template("admin/category_form.html", category=cat)
 
@@ -110,18 +186,24 @@ def category_delete(cid: int):
     """
     Удаляет категорию товаров из базы данных.
 
-    Категория выбирается по идентификатору. При успешном удалении выполняется
-    редирект обратно к списку категорий.
+    Категория удаляется запросом 'DELETE' по идентификатору без предварительной
+    выборки; товары этой категории становятся товарами без категории. При
+    успешном удалении выполняется редирект обратно к списку категорий.
 
     Параметры:
         cid: Идентификатор категории, которую нужно удалить.
 
     Возвращает:
-        Response: Редирект на страницу со списком категорий.
+        Response: Редирект на страницу со списком категорий или ошибка 404.
     """
-    cat = Category.query.get_or_404(cid)
-    db.session.delete(cat)
+    Product.query.filter_by(category_id=cid).update({"category_id": None}, synchronize_session=False)
+    deleted = Category.query.filter_by(id=cid).delete(synchronize_session=False)
+    if not deleted:
+        db.session.rollback()
+        abort(404)
     db.session.commit()
+    _clear_dashboard_stats()
+    bump_catalog_version()
     return redirect(url_for("admin.categories"))
 
 @admin_bp.route("/products")
@@ -131,13 +213,19 @@ def products():
     Отображает список товаров в админ-панели.
 
     Товары сортируются по убыванию идентификатора (новые сверху). В таблице
-    показываются основные поля, включая цену и превью изображения.
+    показываются основные поля, включая цену и превью изображения. Список
+    выводится постранично, номер страницы передаётся параметром 'page'.
 
     Возвращает:
         Response: HTML-страница со списком товаров.
     """
-    prods = Product.query.order_by(Product.id.desc()).all()
-    return render_template("admin/products.html", products=prods)
+    page = request.args.get("page", 1, type=int)
+    pagination = (Product.query
+                  .options(load_only(Product.id, Product.name, Product.price_cents, Product.image, Product.category_id),
+                           selectinload(Product.category))
+                  .order_by(Product.id.desc())
+                  .paginate(page=page, per_page=_PER_PAGE, error_out=False))
+    return render_template("admin/products.html", products=pagination.items, pagination=pagination)
 
 @admin_bp.route("/products/new", methods=["GET","POST"])
 @login_required
@@ -154,17 +242,17 @@ def product_new():
     """
     categories = Category.query.order_by(Category.name.asc()).all()
     if request.method == "POST":
-        name = request.form.get("name","").strip()
-        price = float(request.form.get("price","0") or 0)
-        description = request.form.get("description","").strip()
-        image_url = request.form.get("image","").strip()
-        category_id = request.form.get("category_id", type=int)
+        f = request.form
+        name = f.get("name","").strip()
+        price = float(f.get("price","0") or 0)
+        description = f.get("description","").strip()
+        image_url = f.get("image","").strip()
+        category_id = f.get("category_id", type=int)
         file = request.files.get("file")
         if file and file.filename and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            upload_path = os.path.join("static/uploads", filename)
-            os.makedirs("static/uploads", exist_ok=True)
-            file.save(upload_path)
+            upload_path = os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
+            save_upload(file, upload_path)
             image_url = f"uploads/{filename}"
         if not name:
             flash("Название обязательно")
@@ -178,6 +266,8 @@ def product_new():
         )
         db.session.add(prod)
         db.session.commit()
+        _clear_dashboard_stats()
+        bump_catalog_version()
         return redirect(url_for("admin.products"))
     return render_template("admin/product_form.html", categories=categories, product=None)
 
@@ -199,20 +289,22 @@ def product_edit(pid: int):
     prod = Product.query.get_or_404(pid)
     categories = Category.query.order_by(Category.name.asc()).all()
     if request.method == "POST":
-        prod.name = request.form.get("name","").strip()
-        prod.price = float(request.form.get("price","0") or 0)
-        prod.description = request.form.get("description","").strip()
-        image_url = request.form.get("image","").strip()
+        f = request.form
+        prod.name = f.get("name","").strip()
+        prod.price = float(f.get("price","0") or 0)
+        prod.description = f.get("description","").strip()
+        image_url = f.get("image","").strip()
         file = request.files.get("file")
         if file and file.filename and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            upload_path = os.path.join("static/uploads", filename)
-            os.makedirs("static/uploads", exist_ok=True)
-            file.save(upload_path)
+            upload_path = os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
+            save_upload(file, upload_path)
             image_url = f"uploads/{filename}"
         if image_url: prod.image = image_url
-        prod.category_id = request.form.get("category_id", type=int) or None
-        db.session.commit(); return redirect(url_for("admin.products"))
+        prod.category_id = f.get("category_id", type=int) or None
+        db.session.commit()
+        bump_catalog_version()
+        return redirect(url_for("admin.products"))
     return render_template("admin/product_form.html", categories=categories, product=prod)
 
 @admin_bp.route("/products/<int:pid>/delete", methods=["POST"])
@@ -221,18 +313,22 @@ def product_delete(pid: int):
     """
     Удаляет товар из каталога.
 
-    Товар выбирается по идентификатору. После удаления пользователь
-    перенаправляется обратно к списку товаров.
+    Товар удаляется запросом 'DELETE' по идентификатору без предварительной
+    выборки. После удаления пользователь перенаправляется обратно к списку товаров.
 
     Параметры:
         pid: Идентификатор товара, который нужно удалить.
 
     Возвращает:
-        Response: Редирект на страницу со списком товаров.
+        Response: Редирект на страницу со списком товаров или ошибка 404.
     """
-    prod = Product.query.get_or_404(pid)
-    db.session.delete(prod)
+    deleted = Product.query.filter_by(id=pid).delete(synchronize_session=False)
+    if not deleted:
+        db.session.rollback()
+        abort(404)
     db.session.commit()
+    _clear_dashboard_stats()
+    bump_catalog_version()
     return redirect(url_for("admin.products"))
 
 @admin_bp.route("/orders")
@@ -242,13 +338,20 @@ def orders():
     Отображает список всех заказов в админ-панели.
 
     Заказы сортируются по дате создания в обратном порядке. В таблице
-    показываются клиент, адрес, состав и текущий статус заказа.
+    показываются клиент, адрес, состав и текущий статус заказа. Список
+    выводится постранично, номер страницы передаётся параметром 'page'.
 
     Возвращает:
         Response: HTML-страница со списком заказов.
     """
-    orders = Order.query.order_by(Order.created_at.desc()).all()
-    return render_template("admin/orders.html", orders=orders)
+    page = request.args.get("page", 1, type=int)
+    pagination = (Order.query
+                  .options(load_only(Order.id, Order.created_at, Order.customer_name, Order.email,
+                                     Order.address, Order.status),
+                           selectinload(Order.items).selectinload(OrderItem.product))
+                  .order_by(Order.created_at.desc())
+                  .paginate(page=page, per_page=_PER_PAGE, error_out=False))
+    return render_template("admin/orders.html", orders=pagination.items, pagination=pagination)
 
 @admin_bp.route("/orders/<int:order_id>/status", methods=["POST"])
 @login_required
@@ -258,28 +361,22 @@ def order_status(order_id: int):
 
     Принимает новый статус из формы и, если он входит в список допустимых
     значений ('new', 'pending', 'awaiting_payment', 'paid', 'canceled'),
-    сохраняет изменения в базе данных.
+    сохраняет его одним запросом 'UPDATE' без предварительной выборки заказа.
 
     Параметры:
         order_id: Идентификатор заказа, статус которого нужно изменить.
 
     Возвращает:
-        Response: Редирект обратно на страницу со списком заказов.
+        Response: Редирект обратно на страницу со списком заказов или ошибка 404.
     """
-    order = Order.query.get_or_404(order_id)
-    new_status = (request.form.get("status") or "").strip()
-    if new_status in {"new","pending","awaiting_payment","paid","canceled"}:
-        if new_status == "pending":
-            order.status = "Обработка платежа"
-        elif new_status == "awaiting_payment":
-            order.status = "Ожидание платежа"
-        elif new_status == "paid":
-            order.status = "Оплачено"
-        elif new_status == "canceled":
-            order.status = "Платёж отменён"
-
-        db.session.commit()
-        flash(f"Статус заказа №{order.id} обновлён → {order.status}")
-    else:
+    status = _STATUS_MAP.get((request.form.get("status") or "").strip())
+    if status is None:
         flash("Недопустимый статус")
+        return redirect(url_for("admin.orders"))
+    updated = Order.query.filter_by(id=order_id).update({"status": status}, synchronize_session=False)
+    if not updated:
+        db.session.rollback()
+        abort(404)
+    db.session.commit()
+    flash(f"Статус заказа №{order_id} обновлён → {status}")
     return redirect(url_for("admin.orders"))
@@ -1,26 +1,52 @@
+import os
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_user, logout_user, login_required, current_user
-from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from itsdangerous import BadSignature, SignatureExpired
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import selectinload
+from werkzeug.utils import secure_filename
 from ...extensions import db
-from ...models import User, Order
-from ...utils import password_is_strong, allowed_file
+from ...models import User, Order, OrderItem
+from ...utils import password_is_strong, allowed_file, save_upload
 
 auth_bp = Blueprint("auth", __name__)
 
 def _ts(app):
     """
-    Создаёт сериализатор токенов на основе секретного ключа приложения.
+    Возвращает сериализатор токенов, созданный один раз в 'create_app()'.
 
     Используется для генерации и проверки токенов подтверждения email и
     восстановления пароля через библиотеку 'itsdangerous'.
 
     Параметры:
-        app: Экземпляр Flask-приложения с установленным 'secret_key'.
+        app: Экземпляр Flask-приложения, созданный через 'create_app()'.
 
     Возвращает:
         URLSafeTimedSerializer: Сериализатор с заданной «солью».
     """
-    return URLSafeTimedSerializer(app.secret_key, salt="email-confirm-salt")
+    return app.extensions["ts"]
+
+def _token_url(app, endpoint: str, path: str, token: str) -> str:
+    """
+    Формирует абсолютную ссылку с токеном для писем подтверждения и сброса пароля.
+
+    Если в конфигурации задан 'APP_BASE_URL', ссылка собирается простой
+    подстановкой токена в путь без обращения к маршрутизатору Werkzeug.
+    Иначе используется 'url_for(..., _external=True)' по текущему запросу.
+
+    Параметры:
+        app: Экземпляр Flask-приложения;
+        endpoint: Имя маршрута для запасного варианта через 'url_for';
+        path: Путь маршрута без токена, например '/confirm/';
+        token: Токен, подписанный сериализатором '_ts'.
+
+    Возвращает:
+        str: Абсолютная ссылка с токеном.
+    """
+    base = app.config["APP_BASE_URL"]
+    if base:
+        return f"{base}{path}{token}"
+    return url_for(endpoint, token=token, _external=True)
 
 @auth_bp.route("/register", methods=["GET","POST"])
 def register():
@@ -47,7 +73,7 @@ def register():
         if not password_is_strong(password):
             flash("Пароль слишком простой: минимум 6 символов, 1 заглавная бука, 1 цифра и 1 спецсимвол")
             return render_template("register.html", email=email)
-        if User.query.filter_by(email=email).first():
+        if db.session.query(User.query.filter_by(email=email).exists()).scalar():
             flash("Такой пользователь уже существует")
             return render_template("register.html", email=email)
         user = User(email=email)
@@ -55,9 +81,8 @@ def register():
         db.session.add(user)
         db.session.commit()
         token = _ts(app).dumps(email)
-        flash(f"Регистрация прошла успешно. Подтвердите email: { url_for('auth.confirm_email',
-                                                                         token=token,
-                                                                         _external=True) }")
+        link = _token_url(app, "auth.confirm_email", "/confirm/", token)
+        flash(f"Регистрация прошла успешно. Подтвердите email: {link}")
         return redirect(url_for("auth.login"))
     return render_template("register.html")
 
@@ -68,6 +93,7 @@ def login():
 
     При успешной проверке пароля логинит пользователя через Flask-Login и
     перенаправляет либо на страницу из параметра 'next', либо в каталог.
+    Если хэш пароля построен с устаревшими параметрами, он пересчитывается.
 
     Возвращает:
         Response: HTML-страница входа или редирект после успешной аутентификации.
@@ -77,6 +103,9 @@ def login():
         password = request.form.get("password","")
         user = User.query.filter_by(email=email).first()
         if user and user.check_password(password):
+            if user.password_needs_rehash():
+                user.set_password(password)
+                db.session.commit()
             login_user(user)
             return redirect(request.args.get("next") or url_for("shop.index"))
         flash("Неверный email или пароль")
@@ -116,7 +145,7 @@ def send_confirm_email():
         flash("Email уже подтверждён")
         return redirect(url_for("auth.profile"))
     token = _ts(app).dumps(current_user.email)
-    link = url_for("auth.confirm_email", token=token, _external=True)
+    link = _token_url(app, "auth.confirm_email", "/confirm/", token)
     flash(f"Ссылка для подтверждения email: {link}")
     return redirect(url_for("auth.profile"))
 
@@ -171,7 +200,7 @@ def password_forgot():
         user = User.query.filter_by(email=email).first()
         if user:
             token = _ts(app).dumps(email)
-            reset_link = url_for("auth.password_reset", token=token, _external=True)
+            reset_link = _token_url(app, "auth.password_reset", "/password/reset/", token)
             flash(f"Если такой пользователь существует, ссылка для сброса: {reset_link} (действует 30 минут)")
         else:
             flash("Если такой пользователь существует, ссылка для сброса отправлена на email.")
@@ -213,9 +242,6 @@ def password_reset(token):
         if pwd != pwd2:
             flash("Пароли не совпадают.")
             return redirect(request.url)
-
-        from ...utils import password_is_strong
-
         if not password_is_strong(pwd):
             flash("Пароль слишком простой.")
             return redirect(request.url)
@@ -231,16 +257,19 @@ def account():
     """
     Отображает личный кабинет пользователя с историей заказов.
 
-    Показывает заказы, связанные с текущим пользователем по 'user_id'.
-    Если таких заказов нет (например, были сделаны как гость по email),
-    пытается подгрузить заказы по полю 'email'.
+    Показывает заказы, связанные с текущим пользователем по 'user_id', а также
+    гостевые заказы, оформленные на его email. Обе выборки выполняются одним
+    запросом.
 
     Возвращает:
         Response: HTML-страница со списком заказов пользователя.
     """
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
-    if not orders:
-        orders = Order.query.filter_by(email=current_user.email).order_by(Order.created_at.desc()).all()
+    orders = (Order.query
+              .options(selectinload(Order.items).selectinload(OrderItem.product))
+              .filter(or_(Order.user_id == current_user.id,
+                          and_(Order.user_id.is_(None), Order.email == current_user.email)))
+              .order_by(Order.created_at.desc())
+              .all())
     return render_template("account.html", orders=orders)
 
 @auth_bp.route("/account/order/<int:order_id>")
@@ -258,7 +287,7 @@ def account_order(order_id: int):
     Возвращает:
         Response: HTML-страница с деталями заказа или ошибка доступа.
     """
-    order = Order.query.get_or_404(order_id)
+    order = Order.query.options(selectinload(Order.items).selectinload(OrderItem.product)).get_or_404(order_id)
     allowed = (order.user_id == current_user.id) if order.user_id is not None else (order.email == current_user.email)
     if not (allowed or current_user.is_admin):
         return "", 403
@@ -278,23 +307,20 @@ def profile():
     Возвращает:
         Response: HTML-страница профиля или редирект после успешного обновления.
     """
+    from flask import current_app as app
+
     user = current_user
     if request.method == "POST":
         action = request.form.get("action","save_profile")
         if action == "save_profile":
             user.full_name = (request.form.get("full_name") or "").strip()
             user.default_address = (request.form.get("default_address") or "").strip()
-            from werkzeug.utils import secure_filename
             file = request.files.get("avatar")
             if file and file.filename and allowed_file(file.filename):
-                import os
                 filename = secure_filename(file.filename)
-                folder = "static/uploads/avatars"
-                os.makedirs(folder, exist_ok=True)
-                path = os.path.join(folder, filename)
-                file.save(path)
+                path = os.path.join(app.config["UPLOAD_FOLDER"], "avatars", filename)
+                save_upload(file, path)
                 user.avatar = f"uploads/avatars/{filename}"
-            from ...extensions import db
             db.session.commit()
             flash("Профиль обновлён")
         elif action == "change_password":
@@ -304,7 +330,6 @@ def profile():
             if not user.check_password(cur):
                 flash("Текущий пароль неверен")
                 return redirect(url_for("auth.profile"))
-            from ...utils import password_is_strong
             if not password_is_strong(pwd):
                 flash("Пароль слишком простой")
                 return redirect(url_for("auth.profile"))
@@ -312,7 +337,6 @@ def profile():
                 flash("Пароли не совпадают")
                 return redirect(url_for("auth.profile"))
             user.set_password(pwd)
-            from ...extensions import db
             db.session.commit()
             flash("Пароль изменён")
         return redirect(url_for("auth.profile"))
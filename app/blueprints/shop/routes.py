@@ -1,32 +1,119 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+import functools
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort, current_app, session
 from flask_login import current_user
-from sqlalchemy import func
-from ...extensions import STRIPE_SECRET_KEY, STRIPE_PUBLISHABLE_KEY, STRIPE_CURRENCY, db
-import stripe
-from ...models import Product, Order, OrderItem
-from ...utils import cart_items, get_cart, save_cart, order_total
+from sqlalchemy import func, select, insert, or_, bindparam, text, inspect
+from sqlalchemy.orm import lazyload
+from ...extensions import STRIPE_SECRET_KEY, STRIPE_PUBLISHABLE_KEY, STRIPE_CURRENCY, db, cache
+from ...models import Product, Order, OrderItem, FTS_MIN_SQLITE_VERSION
+from ...utils import cart_items, get_cart, save_cart, cart_size, order_total, catalog_version
 
 shop_bp = Blueprint("shop", __name__)
 
+_stripe_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="stripe")
+_STRIPE_RETRIES = 4
+_STRIPE_PENDING_TIMEOUT = timedelta(minutes=2)
+
+@functools.lru_cache(maxsize=1)
+def _get_stripe():
+    """
+    Импортирует и настраивает SDK Stripe при первом обращении.
+
+    Модуль 'stripe' тянет за собой HTTP-клиент и множество классов ресурсов,
+    поэтому он загружается только когда нужна онлайн-оплата, а не при старте
+    каждого воркера и CLI-команды. Ключ 'STRIPE_SECRET_KEY' задаётся при
+    первом вызове, дальше возвращается тот же модуль.
+
+    Возвращает:
+        module: Модуль 'stripe' с установленным 'stripe.api_key'.
+    """
+    import stripe
+    stripe.api_key = STRIPE_SECRET_KEY
+    return stripe
+
+_CATALOG = select(Product).order_by(Product.id.desc())
+_CATALOG_SEARCH = _CATALOG.where(or_(Product.name.ilike(bindparam("like")),
+                                     Product.description.ilike(bindparam("like"))))
+_CATALOG_FTS = _CATALOG.where(text("product.id IN (SELECT rowid FROM product_fts WHERE product_fts MATCH :match)"))
+
+_MAX_USER_NO = select(func.max(Order.user_order_no)).where(Order.user_id == bindparam("uid"))
+_MAX_EMAIL_NO = select(func.max(Order.user_order_no)).where(Order.user_id.is_(None), Order.email == bindparam("em"))
+
+def _product_fts_ready() -> bool:
+    """
+    Проверяет, можно ли искать товары по полнотекстовому индексу 'product_fts'.
+
+    Индекс доступен только в SQLite не старее 'FTS_MIN_SQLITE_VERSION'
+    (токенизатор 'trigram') и только если таблица уже создана командами
+    'init-db' или 'migrate-db'. Положительный результат запоминается в
+    'app.extensions', отрицательный перепроверяется при следующем поиске.
+
+    Возвращает:
+        bool: 'True', если поиск можно выполнять через 'product_fts'.
+    """
+    ext = current_app.extensions
+    if not ext.get("product_fts"):
+        bind = db.session.get_bind()
+        ext["product_fts"] = (bind.dialect.name == "sqlite"
+                              and sqlite3.sqlite_version_info >= FTS_MIN_SQLITE_VERSION
+                              and inspect(bind).has_table("product_fts"))
+    return ext["product_fts"]
+
+_INDEX_CACHE_TIMEOUT = 120
+
+def _index_cache_key() -> str:
+    """
+    Формирует ключ кэша главной страницы из версии каталога и строки поиска.
+
+    Возвращает:
+        str: Ключ вида 'shop.index/<версия каталога>/<q>'.
+    """
+    return f"shop.index/{catalog_version()}/{request.args.get('q', '').strip()}"
+
+def _index_uncacheable() -> bool:
+    """
+    Определяет, что главную страницу нельзя брать из кэша или класть в него.
+
+    Страница содержит данные сессии: шапку авторизованного пользователя,
+    количество товаров в корзине и flash-сообщения. Кэшируется только
+    вариант для анонимного посетителя с пустой корзиной без сообщений.
+
+    Возвращает:
+        bool: 'True', если страницу нужно отрисовать заново.
+    """
+    return current_user.is_authenticated or bool(session.get("cart")) or bool(session.get("_flashes"))
+
 @shop_bp.route("/")
+@cache.cached(timeout=_INDEX_CACHE_TIMEOUT, make_cache_key=_index_cache_key, unless=_index_uncacheable)
 def index():
     """
     Отображает главную страницу каталога товаров.
 
     Поддерживает простой поиск по названию и описанию товара через параметр
     строки запроса ``q``. Результаты сортируются по убыванию идентификатора,
-    то есть новые товары будут показаны первыми.
+    то есть новые товары будут показаны первыми. Запросы каталога построены
+    заранее на уровне модуля, а строка поиска передаётся связанным параметром.
+    В SQLite запросы от трёх символов ищутся по полнотекстовому индексу
+    'product_fts' (FTS5 с триграммами), более короткие, а также любые запросы
+    при недоступном индексе (см. '_product_fts_ready') — через 'ILIKE'.
+    При заданном 'REDIS_URL' страница для анонимных посетителей с пустой
+    корзиной кэшируется на '_INDEX_CACHE_TIMEOUT' секунд; изменения каталога
+    в админ-панели сбрасывают кэш через 'bump_catalog_version'.
 
     Возвращает:
         str: HTML-страница каталога с перечнем товаров.
     """
     q = request.args.get("q","").strip()
-    query = Product.query
-    if q:
-        like = f"%{q}%"
-        from sqlalchemy import or_
-        query = query.filter(or_(Product.name.ilike(like), Product.description.ilike(like)))
-    products = query.order_by(Product.id.desc()).all()
+    if len(q) >= 3 and _product_fts_ready():
+        match = '"' + q.replace('"', '""') + '"'
+        products = db.session.scalars(_CATALOG_FTS, {"match": match}).all()
+    elif q:
+        products = db.session.scalars(_CATALOG_SEARCH, {"like": f"%{q}%"}).all()
+    else:
+        products = db.session.scalars(_CATALOG).all()
     return render_template("index.html", products=products, q=q)
 
 @shop_bp.route("/product/<int:pid>")
@@ -72,13 +159,14 @@ def cart_add(pid: int):
     Возвращает:
         Response: JSON-ответ для AJAX-запроса или редирект для обычного запроса.
     """
-    Product.query.get_or_404(pid)
+    if db.session.query(Product.id).filter_by(id=pid).scalar() is None:
+        abort(404)
     qty = int(request.form.get("qty", 1))
     cart = get_cart()
     cart[str(pid)] = cart.get(str(pid), 0) + max(1, qty)
     save_cart(cart)
     if request.headers.get("X-Requested-With") == "XMLHttpRequest":
-        return jsonify({"ok": True, "pid": pid, "qty": cart[str(pid)], "cart_size": len(cart)})
+        return jsonify({"ok": True, "pid": pid, "qty": cart[str(pid)], "cart_size": cart_size()})
     flash("Товар добавлен в корзину")
     return redirect(request.referrer or url_for("shop.index"))
 
@@ -117,7 +205,28 @@ def cart_update_api():
     save_cart(cart)
     items, total = cart_items(Product)
     lines = {str(row["product"].id): round(row["line_total"], 2) for row in items}
-    return jsonify({"ok": True, "total": round(total, 2), "lines": lines, "cart_size": len(cart)})
+    return jsonify({"ok": True, "total": round(total, 2), "lines": lines, "cart_size": cart_size()})
+
+def _safe_int(value: str) -> int:
+    """
+    Преобразует строку из формы в целое число, возвращая 0 при ошибке.
+
+    Обычные неотрицательные числа из ASCII-цифр распознаются без обработки
+    исключений; остальные строки (в том числе Unicode-цифры вроде '²', для
+    которых 'str.isdigit' истинно) разбираются 'int' внутри 'try'.
+
+    Параметры:
+        value: Строковое значение поля формы.
+
+    Возвращает:
+        int: Распознанное число или 0, если строка не является числом.
+    """
+    if value.isascii() and value.isdecimal():
+        return int(value)
+    try:
+        return int(value)
+    except ValueError:
+        return 0
 
 @shop_bp.route("/cart/update", methods=["POST"])
 def cart_update():
@@ -131,16 +240,9 @@ def cart_update():
     Возвращает:
         Response: Редирект обратно на страницу корзины.
     """
-    cart = {}
-    for key, value in request.form.items():
-        if key.startswith("qty_"):
-            pid = key.split("_", 1)[1]
-            try:
-                qty = max(0, int(value))
-            except ValueError:
-                qty = 0
-            if qty > 0:
-                cart[pid] = qty
+    cart = {key[4:]: qty for key, value in request.form.items()
+            if key.startswith("qty_") and key[4:].isascii() and key[4:].isdecimal()
+            and (qty := _safe_int(value)) > 0}
     save_cart(cart)
     flash("Корзина обновлена")
     return redirect(url_for("shop.cart_view"))
@@ -166,14 +268,15 @@ def checkout():
         * валидирует введённые имя, email и адрес;
         * создаёт запись ``Order`` и связанные ``OrderItem`` в базе данных;
         * назначает пользователю локальный номер заказа ``user_order_no``;
-        * при наличии ключей Stripe пытается создать Checkout Session и
-          перенаправляет пользователя на страницу оплаты;
-        * при ошибке Stripe или отсутствии ключей выставляет статус
-          ``awaiting_payment`` и показывает страницу благодарности.
+        * при наличии ключей Stripe ставит создание Checkout Session в фоновую
+          очередь и перенаправляет пользователя на страницу ожидания
+          ``payment_pending``, откуда он попадёт на страницу оплаты;
+        * при отсутствии ключей выставляет статус ``awaiting_payment`` и
+          показывает страницу благодарности.
 
     Возвращает:
         Response: HTML-страница оформления заказа, страница благодарности или
-        редирект на Stripe Checkout.
+        редирект на страницу ожидания оплаты.
     """
     items, total = cart_items(Product)
     if request.method == "GET":
@@ -203,52 +306,117 @@ def checkout():
     order = Order(customer_name=name, email=email, address=address, status="Обработка платежа",
                   user_id=(current_user.id if current_user.is_authenticated else None))
     if order.user_id is not None:
-        last_no = db.session.query(func.max(Order.user_order_no)).filter(Order.user_id == order.user_id).scalar() or 0
-        order.user_order_no = last_no + 1
+        stmt, params = _MAX_USER_NO, {"uid": order.user_id}
     else:
-        last_no = db.session.query(func.max(Order.user_order_no)).filter(Order.user_id.is_(None),
-                                                                         Order.email == order.email).scalar() or 0
-        order.user_order_no = last_no + 1
+        stmt, params = _MAX_EMAIL_NO, {"em": order.email}
+    order.user_order_no = (db.session.execute(stmt, params).scalar() or 0) + 1
     db.session.add(order)
-    for row in items:
-        db.session.add(OrderItem(order=order,
-                                 product_id=row["product"].id,
-                                 quantity=row["qty"],
-                                 price_snapshot=row["product"].price))
+    db.session.flush()
+    db.session.execute(insert(OrderItem), [{"order_id": order.id,
+                                            "product_id": row["product"].id,
+                                            "quantity": row["qty"],
+                                            "price_snapshot": row["product"].price} for row in items])
     db.session.commit()
 
     if STRIPE_SECRET_KEY and STRIPE_PUBLISHABLE_KEY:
-        try:
-            line_items = [{
-                "price_data": {
-                    "currency": STRIPE_CURRENCY,
-                    "product_data": {"name": row["product"].name},
-                    "unit_amount": int(round(row["product"].price * 100)),
-                },
-                "quantity": int(row["qty"]),
-            } for row in items]
-            session_obj = stripe.checkout.Session.create(
-                payment_method_types=["card"],
-                mode="payment",
-                line_items=line_items,
-                success_url=url_for("shop.payment_success", order_id=order.id, _external=True),
-                cancel_url=url_for("shop.payment_cancel", order_id=order.id, _external=True),
-                customer_email=email,
-                metadata={"order_id": str(order.id)}
-            )
-            order.stripe_session_id = session_obj.id
-            db.session.commit()
-            save_cart({})
-            return redirect(session_obj.url, code=303)
-        except Exception as e:
-            print("Stripe error:", e)
-            flash("Не удалось создать платёжную сессию. Заказ без онлайн-оплаты.")
+        line_items = [{
+            "price_data": {
+                "currency": STRIPE_CURRENCY,
+                "product_data": {"name": row["product"].name},
+                "unit_amount": row["product"].price_cents,
+            },
+            "quantity": int(row["qty"]),
+        } for row in items]
+        _stripe_executor.submit(_create_stripe_session,
+                                current_app._get_current_object(),
+                                order.id,
+                                dict(payment_method_types=["card"],
+                                     mode="payment",
+                                     line_items=line_items,
+                                     success_url=url_for("shop.payment_success", order_id=order.id, _external=True),
+                                     cancel_url=url_for("shop.payment_cancel", order_id=order.id, _external=True),
+                                     customer_email=email,
+                                     metadata={"order_id": str(order.id)}))
+        save_cart({})
+        return redirect(url_for("shop.payment_pending", order_id=order.id))
 
     order.status = "Ожидание оплаты"
     db.session.commit()
     save_cart({})
     return render_template("thankyou.html", order=order, total=order_total(order))
 
+def _create_stripe_session(app, order_id: int, params: dict) -> None:
+    """
+    Создаёт Stripe Checkout Session для заказа в фоновом потоке.
+
+    Выполняется в пуле '_stripe_executor', чтобы HTTPS-запрос к Stripe не
+    занимал поток обработки запроса. Временные ошибки Stripe (сеть, лимит
+    запросов) повторяются с экспоненциальной задержкой. При успехе в заказ
+    записываются 'stripe_session_id' и адрес страницы оплаты
+    'stripe_checkout_url', если заказ ещё ждёт платёжную сессию; сессия,
+    созданная уже после перехода заказа в другой статус, только логируется,
+    чтобы её можно было отменить в Stripe. При окончательной ошибке (включая
+    ошибку импорта SDK) заказ переводится в статус ожидания оплаты без
+    онлайн-платежа.
+
+    Параметры:
+        app: Экземпляр Flask-приложения для создания контекста приложения;
+        order_id: Идентификатор заказа;
+        params: Аргументы для 'stripe.checkout.Session.create'.
+
+    Возвращает:
+        None: Результат сохраняется в заказе.
+    """
+    with app.app_context():
+        try:
+            stripe = _get_stripe()
+            for attempt in range(_STRIPE_RETRIES):
+                try:
+                    session_obj = stripe.checkout.Session.create(**params)
+                    break
+                except (stripe.APIConnectionError, stripe.RateLimitError):
+                    if attempt == _STRIPE_RETRIES - 1:
+                        raise
+                    time.sleep(0.5 * 2 ** attempt)
+            updated = (Order.query.filter_by(id=order_id, status="Обработка платежа")
+                       .update({"stripe_session_id": session_obj.id, "stripe_checkout_url": session_obj.url},
+                               synchronize_session=False))
+            if not updated:
+                app.logger.warning("Stripe session %s created after order %s stopped waiting for it; "
+                                   "expire it in Stripe", session_obj.id, order_id)
+        except Exception:
+            app.logger.exception("Stripe error for order %s", order_id)
+            Order.query.filter_by(id=order_id).update({"status": "Ожидание оплаты"}, synchronize_session=False)
+        db.session.commit()
+
+@shop_bp.route("/payment/pending")
+def payment_pending():
+    """
+    Ожидает создания платёжной сессии Stripe для только что оформленного заказа.
+
+    Пока фоновая задача '_create_stripe_session' не завершилась, показывает
+    страницу, которая периодически перезагружается. Когда сессия создана,
+    перенаправляет пользователя на сохранённый в заказе адрес Stripe Checkout
+    без обращения к API Stripe. Если создать сессию не удалось или она не
+    появилась за '_STRIPE_PENDING_TIMEOUT' с момента оформления (например,
+    задача потерялась при перезапуске воркера), заказ переводится в статус
+    ожидания оплаты и показывается страница благодарности.
+
+    Возвращает:
+        Response: Страница ожидания, редирект на Stripe или страница благодарности.
+    """
+    order_id = request.args.get("order_id", type=int)
+    order = Order.query.options(lazyload(Order.items)).get_or_404(order_id)
+    if order.stripe_checkout_url:
+        return redirect(order.stripe_checkout_url, code=303)
+    if order.status == "Обработка платежа":
+        if datetime.utcnow() - order.created_at < _STRIPE_PENDING_TIMEOUT:
+            return render_template("payment_pending.html", order=order)
+        order.status = "Ожидание оплаты"
+        db.session.commit()
+    flash("Не удалось создать платёжную сессию. Заказ без онлайн-оплаты.")
+    return render_template("thankyou.html", order=order, total=order_total(order))
+
 @shop_bp.route("/payment/success")
 def payment_success():
     """
@@ -261,7 +429,7 @@ def payment_success():
         Response: HTML-страница «Спасибо за заказ».
     """
     order_id = request.args.get("order_id", type=int)
-    order = Order.query.get_or_404(order_id)
+    order = Order.query.options(lazyload(Order.items)).get_or_404(order_id)
     order.status = "Оплачено"
     db.session.commit()
     return render_template("thankyou.html", order=order, total=order_total(order))
@@ -279,7 +447,7 @@ def payment_cancel():
         Response: Редирект на страницу оформления заказа.
     """
     order_id = request.args.get("order_id", type=int)
-    order = Order.query.get_or_404(order_id)
+    order = Order.query.options(lazyload(Order.items)).get_or_404(order_id)
     order.status = "Платёж отменён"
     db.session.commit()
     return redirect(url_for("shop.checkout"))
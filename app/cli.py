@@ -1,6 +1,9 @@
+import sqlite3
 import click
+from sqlalchemy import inspect, text
 from .extensions import db
-from .models import Category, Product, User
+from .models import Category, Product, User, PRODUCT_FTS_DDL, FTS_MIN_SQLITE_VERSION
+from .utils import bump_catalog_version
 
 def register_cli(app):
     """
@@ -8,6 +11,8 @@ def register_cli(app):
 
     После вызова этой функции в приложении становятся доступны команды:
 
+    * flask --app run init-db — создать таблицы базы данных;
+    * flask --app run migrate-db — обновить схему существующей базы данных;
     * flask --app run seed — заполнить базу демоданными (категории и товары);
     * flask --app run create-admin — создать администратора с указанными
       email и паролем (через аргументы команды или переменные окружения).
@@ -18,6 +23,60 @@ def register_cli(app):
     Возвращает:
         None: Команды регистрируются побочным эффектом.
     """
+    @app.cli.command("init-db")
+    def init_db():
+        """
+        Создаёт все таблицы базы данных по описанию моделей.
+
+        Уже существующие таблицы не изменяются. Команду нужно выполнить один раз
+        при развёртывании проекта, до запуска сервера и команды 'seed'.
+        Запускается как 'flask --app run init-db'.
+
+        Возвращает:
+            None: Таблицы создаются в базе данных, результат выводится в консоль.
+        """
+        db.create_all()
+        click.echo("Таблицы базы данных созданы.")
+
+    @app.cli.command("migrate-db")
+    def migrate_db():
+        """
+        Обновляет схему базы данных, созданной предыдущими версиями проекта.
+
+        Создаёт недостающие таблицы и индексы моделей, а для таблицы 'product'
+        переносит цену из старого столбца 'price' (рубли, float) в целые копейки
+        'price_cents' и удаляет старый столбец, а в таблицу 'order' добавляет
+        столбец 'stripe_checkout_url'. Уже выполненные шаги
+        пропускаются, поэтому команду можно запускать повторно; пользователи
+        и заказы сохраняются. В SQLite 3.34+ также создаётся и заполняется
+        полнотекстовый индекс 'product_fts', если его ещё нет. Запускается как
+        'flask --app run migrate-db'.
+
+        Возвращает:
+            None: Схема обновляется в базе данных, результат выводится в консоль.
+        """
+        db.create_all()
+        columns = {c["name"] for c in inspect(db.engine).get_columns("product")}
+        with db.engine.begin() as conn:
+            if "price_cents" not in columns:
+                conn.execute(text("ALTER TABLE product ADD COLUMN price_cents INTEGER NOT NULL DEFAULT 0"))
+                if "price" in columns:
+                    conn.execute(text("UPDATE product SET price_cents = CAST(ROUND(price * 100) AS INTEGER)"))
+            if "price" in columns:
+                conn.execute(text("ALTER TABLE product DROP COLUMN price"))
+            if "stripe_checkout_url" not in {c["name"] for c in inspect(conn).get_columns("order")}:
+                conn.execute(text('ALTER TABLE "order" ADD COLUMN stripe_checkout_url VARCHAR(1024)'))
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+        if (db.engine.dialect.name == "sqlite" and sqlite3.sqlite_version_info >= FTS_MIN_SQLITE_VERSION
+                and not inspect(db.engine).has_table("product_fts")):
+            with db.engine.begin() as conn:
+                for ddl in PRODUCT_FTS_DDL:
+                    conn.execute(text(ddl))
+                conn.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+        click.echo("Схема базы данных обновлена.")
+
     @app.cli.command("seed")
     def seed():
         """
@@ -66,7 +125,7 @@ def register_cli(app):
                             image=d["image"],
                             category=d["category"])
                 db.session.add(p)
-        db.session.commit(); print("Демо товары загружены.")
+        db.session.commit(); bump_catalog_version(); click.echo("Демо товары загружены.")
 
     @app.cli.command("create-admin")
     @click.option("--email", envvar="ADMIN_EMAIL", required=False)
@@ -88,7 +147,7 @@ def register_cli(app):
             None: Информация об операции выводится в консоль, изменения сохраняются в базе.
         """
         if not email or not password:
-            print("Set ADMIN_EMAIL and ADMIN_PASSWORD or pass --email/--password")
+            click.echo("Set ADMIN_EMAIL and ADMIN_PASSWORD or pass --email/--password", err=True)
             return
         user = User.query.filter_by(email=email.lower()).first()
         if not user:
@@ -99,4 +158,4 @@ def register_cli(app):
             user.is_admin = True
             user.set_password(password)
         db.session.commit()
-        print(f"Администратор подтверждён: {email}")
+        click.echo(f"Администратор подтверждён: {email}")
@@ -1,14 +1,92 @@
+import atexit
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from flask.logging import default_handler
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-import os, stripe
+from flask_session import Session
+from flask_caching import Cache
+import os
 
 db = SQLAlchemy()
 login_manager = LoginManager()
 login_manager.login_view = "auth.login"
+server_session = Session()
+cache = Cache()
+
+REDIS_URL = os.environ.get("REDIS_URL")
+
+_log_queue = queue.SimpleQueue()
+_log_listener = None
+
+def init_logging(app) -> None:
+    """
+    Переводит логгер приложения на запись через очередь и фоновый поток.
+
+    Стандартный обработчик Flask ('default_handler', вывод в stderr) переносится
+    в 'QueueListener', а к 'app.logger' подключается 'QueueHandler': поток
+    обработки запроса только кладёт запись в очередь и не ждёт записи в
+    терминал или канал. Слушатель очереди один на процесс и останавливается
+    при завершении интерпретатора, дописывая оставшиеся сообщения.
+
+    Параметры:
+        app: Экземпляр Flask-приложения, созданный в 'create_app()'.
+
+    Возвращает:
+        None: Обработчики логгера настраиваются побочным эффектом.
+    """
+    global _log_listener
+    if any(isinstance(h, QueueHandler) for h in app.logger.handlers):
+        return
+    if _log_listener is None:
+        _log_listener = QueueListener(_log_queue, default_handler, respect_handler_level=True)
+        _log_listener.start()
+        atexit.register(_log_listener.stop)
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(QueueHandler(_log_queue))
+
+def set_sqlite_pragmas(dbapi_conn, _record) -> None:
+    """
+    Настраивает новое соединение SQLite для одновременной работы магазина и админки.
+
+    Включает журнал WAL, чтобы запись из админ-панели не блокировала чтение
+    витрины, ослабляет 'synchronous' до 'NORMAL', увеличивает кэш страниц
+    до 64 МБ и держит временные таблицы в памяти. Регистрируется как
+    обработчик события 'connect' движка SQLAlchemy в 'create_app()'.
+
+    Параметры:
+        dbapi_conn: DB-API соединение 'sqlite3', только что открытое пулом;
+        _record: Запись пула соединений (не используется).
+
+    Возвращает:
+        None: Настройки применяются к соединению побочным эффектом.
+    """
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA cache_size=-65536")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.close()
 
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY")
 STRIPE_PUBLISHABLE_KEY = os.environ.get("STRIPE_PUBLISHABLE_KEY")
 STRIPE_CURRENCY = os.environ.get("STRIPE_CURRENCY", "usd")
 
-if STRIPE_SECRET_KEY:
-    stripe.api_key = STRIPE_SECRET_KEY
+def _env_positive_int(name: str) -> int | None:
+    """
+    Читает из окружения положительное целое число.
+
+    Параметры:
+        name: Имя переменной окружения.
+
+    Возвращает:
+        int | None: Значение переменной или 'None', если она не задана или не является
+        положительным целым числом.
+    """
+    value = os.environ.get(name, "").strip()
+    if value.isascii() and value.isdecimal() and int(value) > 0:
+        return int(value)
+    return None
+
+PASSWORD_HASH_ITERATIONS = _env_positive_int("PASSWORD_HASH_ITERATIONS")
+PASSWORD_HASH_MIN_ITERATIONS = 100_000
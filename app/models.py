@@ -1,11 +1,35 @@
+import sqlite3
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from flask import current_app, has_app_context
 from flask_login import UserMixin
-from .extensions import db
+from sqlalchemy import DDL, event
+from sqlalchemy.ext.hybrid import hybrid_property
+from .extensions import db, PASSWORD_HASH_ITERATIONS, PASSWORD_HASH_MIN_ITERATIONS
+
+def _pbkdf2_method() -> str | None:
+    """
+    Возвращает метод PBKDF2 для 'generate_password_hash', если он включён в настройках.
+
+    PBKDF2-SHA256 используется только при заданной переменной окружения
+    'PASSWORD_HASH_ITERATIONS'; иначе пароли хэшируются методом Werkzeug по
+    умолчанию (scrypt). Число итераций меньше 'PASSWORD_HASH_MIN_ITERATIONS'
+    допускается только в тестовом или отладочном режиме приложения, чтобы
+    ускорить тесты; в остальных случаях оно поднимается до минимума.
+
+    Возвращает:
+        str | None: Строка вида 'pbkdf2:sha256:<итерации>' или 'None' для метода по умолчанию.
+    """
+    if PASSWORD_HASH_ITERATIONS is None:
+        return None
+    iterations = PASSWORD_HASH_ITERATIONS
+    if not (has_app_context() and (current_app.testing or current_app.debug)):
+        iterations = max(iterations, PASSWORD_HASH_MIN_ITERATIONS)
+    return f"pbkdf2:sha256:{iterations}"
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(120), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, index=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
 
@@ -40,7 +64,9 @@ class User(db.Model, UserMixin):
         Устанавливает новый пароль пользователя, сохраняя только его хэш.
 
         Хэш пароля вычисляется с помощью 'werkzeug.security.generate_password_hash'
-        и записывается в поле 'password_hash'. Сам пароль в базе данных не хранится.
+        и записывается в поле 'password_hash'. По умолчанию используется метод
+        Werkzeug (scrypt); при заданной 'PASSWORD_HASH_ITERATIONS' — PBKDF2-SHA256
+        (см. '_pbkdf2_method'). Сам пароль в базе данных не хранится.
 
         Параметры:
             password: Пароль в открытом виде, введённый пользователем.
@@ -48,7 +74,8 @@ class User(db.Model, UserMixin):
         Возвращает:
             None: Значение не возвращается, хэш пароля сохраняется в объекте пользователя.
         """
-        self.password_hash = generate_password_hash(password)
+        method = _pbkdf2_method()
+        self.password_hash = generate_password_hash(password, method=method) if method else generate_password_hash(password)
 
     def check_password(self, password: str) -> bool:
         """
@@ -65,30 +92,79 @@ class User(db.Model, UserMixin):
         """
         return check_password_hash(self.password_hash, password)
 
+    def password_needs_rehash(self) -> bool:
+        """
+        Проверяет, отличаются ли параметры хэша пароля от текущей настройки.
+
+        Хэш считается устаревшим, только если задана 'PASSWORD_HASH_ITERATIONS',
+        а хэш построен PBKDF2-SHA256 с другим числом итераций. Такой пароль стоит
+        пересчитать при следующем успешном входе. Хэши других методов (например,
+        scrypt по умолчанию в Werkzeug) не трогаются, чтобы не ослаблять их.
+
+        Возвращает:
+            bool: 'True', если хэш нужно пересчитать, иначе 'False'.
+        """
+        method = _pbkdf2_method()
+        return (method is not None
+                and self.password_hash.startswith("pbkdf2:sha256:")
+                and not self.password_hash.startswith(f"{method}$"))
+
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), unique=True, nullable=False)
+    name = db.Column(db.String(120), unique=True, index=True, nullable=False)
     products = db.relationship("Product", backref="category", lazy=True)
 
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
-    price = db.Column(db.Float, nullable=False, default=0.0)
+    price_cents = db.Column(db.Integer, nullable=False, default=0)
     description = db.Column(db.Text, default="")
     image = db.Column(db.String(255), default="")
     category_id = db.Column(db.Integer, db.ForeignKey("category.id"))
 
+    @hybrid_property
+    def price(self) -> float:
+        """
+        Возвращает цену товара в рублях.
+
+        Цена хранится в базе данных целым числом копеек в поле 'price_cents';
+        в SQL-выражениях свойство разворачивается в 'price_cents / 100.0'.
+
+        Возвращает:
+            float: Цена товара.
+        """
+        return self.price_cents / 100
+
+    @price.inplace.setter
+    def _price_setter(self, value: float) -> None:
+        """Сохраняет цену в рублях как целое число копеек в 'price_cents'."""
+        self.price_cents = int(round((value or 0) * 100))
+
+    @price.inplace.expression
+    @classmethod
+    def _price_expression(cls):
+        """Возвращает SQL-выражение цены в рублях для запросов по 'Product.price'."""
+        return (cls.price_cents / 100.0).label("price")
+
 class Order(db.Model):
+    __table_args__ = (
+        db.Index("ix_order_user_created", "user_id", "created_at"),
+        db.Index("ix_order_email_created", "email", "created_at"),
+        db.Index("ix_order_user_userno", "user_id", "user_order_no"),
+        db.Index("ix_order_email_userno", "email", "user_order_no"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)
     customer_name = db.Column(db.String(120), nullable=False)
     email = db.Column(db.String(120), nullable=False)
     address = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     status = db.Column(db.String(50), default="new")
     user_order_no = db.Column(db.Integer, nullable=True)
     stripe_session_id = db.Column(db.String(255), default=None)
-    items = db.relationship("OrderItem", backref="order", cascade="all, delete-orphan")
+    stripe_checkout_url = db.Column(db.String(1024), default=None)
+    items = db.relationship("OrderItem", backref="order", cascade="all, delete-orphan", lazy="selectin")
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -97,3 +173,26 @@ class OrderItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False, default=1)
     price_snapshot = db.Column(db.Float, nullable=False, default=0.0)
     product = db.relationship("Product")
+
+FTS_MIN_SQLITE_VERSION = (3, 34)
+
+PRODUCT_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5("
+    "name, description, content='product', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN "
+    "INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN "
+    "INSERT INTO product_fts(product_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE ON product BEGIN "
+    "INSERT INTO product_fts(product_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+)
+
+def _fts_supported(ddl, target, bind, **kw) -> bool:
+    """Разрешает создание 'product_fts' только в SQLite с поддержкой токенизатора 'trigram'."""
+    return sqlite3.sqlite_version_info >= FTS_MIN_SQLITE_VERSION
+
+for _ddl in PRODUCT_FTS_DDL:
+    event.listen(Product.__table__, "after_create", DDL(_ddl).execute_if(dialect="sqlite", callable_=_fts_supported))
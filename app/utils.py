@@ -1,25 +1,46 @@
 import re
-from flask import session, abort
+import shutil
+import time
+from flask import session, abort, g
 from flask_login import current_user
+from sqlalchemy import func, inspect
+from .extensions import db, cache
+from .models import OrderItem
+
+_ALLOWED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+_PASSWORD_RE = re.compile(r"(?=.*[A-Z])(?=.*\d)(?=.*[^A-Za-z0-9]).{6,}", re.DOTALL)
 
 def get_cart() -> dict:
     """
     Возвращает текущее содержимое корзины из сессии пользователя.
 
-    Корзина хранится в объекте 'flask.session' под ключом 'cart'.
-    Если корзина ещё не создавалась, возвращается пустой словарь.
+    Корзина хранится в объекте 'flask.session' под ключом 'cart' в виде
+    компактной строки '"<product_id>:<quantity>,..."' и разбирается в словарь
+    при каждом вызове. Пары, где идентификатор или количество не состоят
+    из ASCII-цифр, пропускаются. Корзина в старом формате (словарь) тоже
+    поддерживается. Если корзина ещё не создавалась, возвращается пустой словарь.
 
     Возвращает:
         dict: Словарь вида '{str(product_id): int(quantity)}' с количеством каждого товара в корзине.
     """
-    return session.get("cart", {})
+    raw = session.get("cart", "")
+    if isinstance(raw, dict):
+        return dict(raw)
+    cart = {}
+    for pair in raw.split(",") if raw else ():
+        pid, _, qty = pair.partition(":")
+        if pid.isascii() and pid.isdecimal() and qty.isascii() and qty.isdecimal():
+            cart[pid] = int(qty)
+    return cart
 
 def save_cart(cart: dict) -> None:
     """
     Сохраняет переданное состояние корзины в сессию пользователя.
 
     Используется всеми обработчиками корзины для обновления данных о товарах
-    в текущей сессии. После сохранения помечает сессию как изменённую.
+    в текущей сессии. Корзина упаковывается в строку '"<product_id>:<quantity>,..."',
+    рядом сохраняется число позиций 'cart_size'; если корзина не изменилась,
+    сессия не перезаписывается и cookie не отправляется заново.
 
     Параметры:
         cart: Словарь вида '{str(product_id): int(quantity)}', представляющий содержимое корзины.
@@ -27,34 +48,87 @@ def save_cart(cart: dict) -> None:
     Возвращает:
         None: Значение не возвращается, данные сохраняются в сессию.
     """
-    session["cart"] = cart
-    session.modified = True
+    packed = ",".join(f"{pid}:{qty}" for pid, qty in cart.items())
+    if session.get("cart") != packed:
+        session["cart"] = packed
+        session["cart_size"] = len(cart)
+
+def cart_size() -> int:
+    """
+    Возвращает количество позиций в корзине без разбора её содержимого.
+
+    Значение сохраняется в сессии функцией 'save_cart' под ключом 'cart_size'.
+    Для сессий, созданных до появления этого ключа, размер считается по корзине.
+
+    Возвращает:
+        int: Число различных товаров в корзине.
+    """
+    size = session.get("cart_size")
+    return len(get_cart()) if size is None else size
 
 def cart_items(Product):
     """
     Преобразует содержимое корзины в список объектов товаров и подсчитывает сумму.
 
     По идентификаторам товаров из корзины выполняет запрос к базе данных,
-    рассчитывает количество и итоговую стоимость по каждой позиции.
+    рассчитывает количество и итоговую стоимость по каждой позиции в целых
+    копейках, переводя в рубли только готовые суммы. Из БД выбираются только
+    столбцы 'id', 'name', 'price', 'price_cents' и 'image' без создания
+    ORM-объектов; результат выборки запоминается в 'flask.g' на время запроса,
+    поэтому повторный вызов с тем же набором товаров не обращается к БД.
 
     Параметры:
         Product: Модель товара SQLAlchemy, используемая для выборки из БД.
 
     Возвращает:
         tuple[list[dict], float]: Кортеж из двух элементов:
-        * список словарей '{"product": Product, "qty": int, "line_total": float}',
+        * список словарей '{"product": Row, "qty": int, "line_total": float}',
+          где 'Row' предоставляет атрибуты 'id', 'name', 'price', 'price_cents' и 'image';
         * общая сумма корзины (float).
     """
     cart = get_cart()
-    ids = [int(pid) for pid in cart.keys()]
-    products = Product.query.filter(Product.id.in_(ids)).all() if ids else []
-    result, total = [], 0.0
+    ids = frozenset(int(pid) for pid in cart.keys())
+    memo = g.setdefault("cart_products", {})
+    products = memo.get(ids)
+    if products is None:
+        products = (db.session.query(Product.id, Product.name, Product.price, Product.price_cents, Product.image)
+                    .filter(Product.id.in_(ids)).all()) if ids else []
+        memo[ids] = products
+    result, total_cents = [], 0
     for p in products:
         qty = int(cart.get(str(p.id), 0))
-        line_total = p.price * qty
-        total += line_total
-        result.append({"product": p, "qty": qty, "line_total": line_total})
-    return result, total
+        line_cents = p.price_cents * qty
+        total_cents += line_cents
+        result.append({"product": p, "qty": qty, "line_total": line_cents / 100})
+    return result, total_cents / 100
+
+def catalog_version() -> int:
+    """
+    Возвращает текущую версию каталога для ключей кэша витрины.
+
+    Версия хранится в кэше Flask-Caching под ключом 'catalog_version' и входит
+    в ключ закэшированной главной страницы, поэтому после её смены старые
+    страницы каталога больше не используются и вытесняются по таймауту.
+    Кэш общий для всех процессов только с Redis; без 'REDIS_URL' используется
+    'NullCache', и версия всегда равна '0'.
+
+    Возвращает:
+        int: Версия каталога или '0', если каталог ещё не изменялся.
+    """
+    return cache.get("catalog_version") or 0
+
+def bump_catalog_version() -> None:
+    """
+    Сбрасывает кэш витрины после изменения товаров или категорий.
+
+    Вызывается обработчиками админ-панели после сохранения изменений в БД.
+    В качестве новой версии записывается текущее время в наносекундах, что
+    не требует атомарного инкремента при нескольких процессах.
+
+    Возвращает:
+        None: Новая версия сохраняется в кэш побочным эффектом.
+    """
+    cache.set("catalog_version", time.time_ns(), timeout=0)
 
 def admin_required() -> None:
     """
@@ -83,7 +157,26 @@ def allowed_file(filename: str) -> bool:
     Возвращает:
         bool: 'True', если расширение допустимо, иначе 'False'.
     """
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in {"png","jpg","jpeg","gif","webp"}
+    return filename.lower().endswith(_ALLOWED_EXTENSIONS)
+
+def save_upload(file, path: str) -> None:
+    """
+    Сохраняет загруженный файл на диск, копируя поток блоками по 1 МБ.
+
+    В отличие от 'FileStorage.save', который копирует данные блоками по 16 КБ,
+    пишет файл крупными блоками, что заметно сокращает число системных вызовов
+    для больших изображений. Блоки больше буфера файла передаются в 'write'
+    напрямую, а буферизованный файл сам дописывает остаток при неполной записи.
+
+    Параметры:
+        file: Объект 'werkzeug.datastructures.FileStorage' из 'request.files';
+        path: Путь, по которому нужно сохранить файл.
+
+    Возвращает:
+        None: Файл записывается на диск побочным эффектом.
+    """
+    with open(path, "wb") as dst:
+        shutil.copyfileobj(file.stream, dst, length=1 << 20)
 
 def password_is_strong(password: str) -> bool:
     """
@@ -95,19 +188,16 @@ def password_is_strong(password: str) -> bool:
     * хотя бы одна цифра (0–9);
     * хотя бы один специальный символ (не буква и не цифра).
 
+    Слишком короткие пароли отсекаются сравнением длины, остальные требования
+    проверяются одним заранее скомпилированным регулярным выражением '_PASSWORD_RE'.
+
     Параметры:
         password: Проверяемый пароль в виде строки.
 
     Возвращает:
         bool: 'True', если пароль достаточно сложный, иначе 'False'.
     """
-    return (
-        isinstance(password, str)
-        and len(password) >= 6
-        and re.search(r"[A-Z]", password) is not None
-        and re.search(r"\d", password) is not None
-        and re.search(r"[^A-Za-z0-9]", password) is not None
-    )
+    return isinstance(password, str) and len(password) >= 6 and _PASSWORD_RE.match(password) is not None
 
 def avatar_url_for(user) -> str:
     """
@@ -135,12 +225,19 @@ def order_total(order) -> float:
 
     Для каждой позиции берётся сохранённая на момент покупки цена ``price_snapshot``
     и умножается на количество 'quantity'. Сумма по всем позициям округляется
-    до двух знаков после запятой.
+    до двух знаков после запятой. Если позиции заказа уже загружены, сумма
+    считается в Python; иначе она вычисляется в БД одним запросом 'SUM' без
+    загрузки объектов 'OrderItem'.
 
     Параметры:
-        order: Экземпляр модели 'Order' с загруженными связанными объектами 'OrderItem'.
+        order: Экземпляр модели 'Order'.
 
     Возвращает:
         float: Итоговая стоимость заказа.
     """
-    return round(sum((it.price_snapshot or 0) * (it.quantity or 0) for it in order.items), 2)
+    if "items" in inspect(order).unloaded:
+        total = (db.session.query(func.coalesce(func.sum(OrderItem.price_snapshot * OrderItem.quantity), 0.0))
+                 .filter(OrderItem.order_id == order.id).scalar())
+    else:
+        total = sum((it.price_snapshot or 0) * (it.quantity or 0) for it in order.items)
+    return round(total, 2)